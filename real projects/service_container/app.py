@@ -2,36 +2,152 @@
 E-commerce API with PostgreSQL and Redis
 Demonstrates service containers in GitHub Actions
 """
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.applications import FastAPI
+from fastapi.exceptions import HTTPException
+from fastapi.param_functions import Header, Query
+from fastapi.responses import ORJSONResponse, Response
+from pydantic.main import BaseModel
+import asyncio
+import hashlib
+import asyncpg
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import redis
-import json
+from redis import asyncio as aioredis
+import orjson
 import os
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+DB_SETTINGS = {
+    "host": os.getenv("POSTGRES_HOST", "postgres"),
+    "database": os.getenv("POSTGRES_DB", "ecommerce"),
+    "user": os.getenv("POSTGRES_USER", "postgres"),
+    "password": os.getenv("POSTGRES_PASSWORD", "testpass"),
+}
+
+if os.getenv("REDIS_SOCKET"):
+    # A colocated Redis can be reached over its UNIX socket, skipping TCP
+    REDIS_URL = f"unix://{os.getenv('REDIS_SOCKET')}"
+    REDIS_SOCKET_OPTIONS = {}
+else:
+    REDIS_URL = f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', '6379')}"
+    REDIS_SOCKET_OPTIONS = {"socket_keepalive": True}
 
 # Database connection
 def get_db_connection():
-    """Get PostgreSQL connection"""
-    return psycopg2.connect(
-        host=os.getenv("POSTGRES_HOST", "postgres"),
-        database=os.getenv("POSTGRES_DB", "ecommerce"),
-        user=os.getenv("POSTGRES_USER", "postgres"),
-        password=os.getenv("POSTGRES_PASSWORD", "testpass"),
-        cursor_factory=RealDictCursor
+    """Get a dedicated blocking PostgreSQL connection for tests and scripts"""
+    return psycopg2.connect(cursor_factory=RealDictCursor, **DB_SETTINGS)
+
+# How long a request waits for a free pooled connection before giving up
+DB_ACQUIRE_TIMEOUT = 5
+
+@asynccontextmanager
+async def db_conn():
+    """Borrow a connection from the pool and return it when done
+
+    asyncpg rolls back any transaction left open when the connection is
+    released, so a failed statement never leaks into the next borrower. When
+    every connection stays busy for DB_ACQUIRE_TIMEOUT seconds the request
+    fails with 503 instead of queueing forever.
+    """
+    pool = app.state.db_pool
+    try:
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Database is busy, try again later")
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+# How long a request waits for a free Redis connection before giving up
+REDIS_POOL_TIMEOUT = 2
+
+# Redis connection (one async client, pooled sockets). When all connections
+# are busy, callers wait up to REDIS_POOL_TIMEOUT for one to come back rather
+# than failing straight away. Idle sockets are kept alive and pinged before
+# reuse so a dropped connection fails fast instead of stalling a request.
+# Replies stay as bytes so cached JSON goes out without a decode/encode pass.
+REDIS = aioredis.Redis(
+    connection_pool=aioredis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=64,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=30,
+        socket_timeout=1,
+        socket_connect_timeout=1,
+        **REDIS_SOCKET_OPTIONS
     )
+)
 
-# Redis connection
 def get_redis_connection():
-    """Get Redis connection"""
-    return redis.Redis(
-        host=os.getenv("REDIS_HOST", "redis"),
-        port=int(os.getenv("REDIS_PORT", "6379")),
-        decode_responses=True
-    )
+    """Get a blocking Redis client for tests and scripts"""
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+PRODUCTS_REV_KEY = "products:rev"
+BULK_INSERT_BATCH_SIZE = 500
+# A bulk request runs in one transaction on one pooled connection, so keep it
+# to a few batches
+MAX_BULK_PRODUCTS = 2000
+
+# Last list revision this worker saw, used to guess the list cache key
+last_products_rev = "0"
+
+def decode_rev(rev):
+    """Revision counter as text (``rev`` is the raw reply, or None if unset)"""
+    return rev.decode() if rev else "0"
+
+def products_list_key(rev, after_id, limit):
+    """Cache key for one page of the product list at a given revision"""
+    return f"products:v{rev}:{after_id}:{limit}"
+
+def page_headers(headers, next_cursor, limit):
+    """Add the next-page cursor headers for a full page"""
+    if next_cursor:
+        headers["X-Next-Cursor"] = str(next_cursor)
+        headers["Link"] = f'</products?after_id={next_cursor}&limit={limit}>; rel="next"'
+    return headers
+
+# Clients may keep responses but must revalidate them with their ETag
+CACHE_CONTROL = "max-age=0, must-revalidate"
+
+def cache_headers(etag):
+    """HTTP caching headers for a response tagged with ``etag``"""
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+def body_etag(prefix, body):
+    """Weak ETag derived from the exact bytes being served"""
+    return f'W/"{prefix}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against ``etag``
+
+    Only call this once the resource is known to exist: ``*`` matches any
+    current representation.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+async def bump_products_rev():
+    """Start a new product list generation; old ones simply expire"""
+    await REDIS.incr(PRODUCTS_REV_KEY)
+
+async def invalidate_product_cache(product_id):
+    """Drop a product and retire the product list in one round-trip"""
+    try:
+        async with REDIS.pipeline(transaction=False) as pipe:
+            pipe.delete(f"product:{product_id}")
+            pipe.incr(PRODUCTS_REV_KEY)
+            await pipe.execute()
+    except redis.RedisError:
+        # Fall back to one command at a time if pipelining fails
+        await REDIS.delete(f"product:{product_id}")
+        await bump_products_rev()
 
 # Models
 class Product(BaseModel):
@@ -47,51 +163,115 @@ class ProductResponse(BaseModel):
     price: float
     stock: int
 
+# Rows come straight from the products table, so responses are documented
+# with these models but never validated against them at runtime
+PRODUCT_RESPONSES = {200: {"model": ProductResponse}}
+PRODUCT_LIST_RESPONSES = {200: {"model": List[ProductResponse]}}
+PRODUCT_PAGE_RESPONSES = {
+    200: {
+        "model": List[ProductResponse],
+        "headers": {
+            "X-Next-Cursor": {
+                "description": "Pass as after_id to get the next page; absent on the last page",
+                "schema": {"type": "integer"},
+            },
+            "Link": {"description": 'URL of the next page (rel="next")'},
+        },
+    }
+}
+
+# SQL statements. asyncpg prepares each distinct query text once per pooled
+# connection and reuses the plan, so keep these fixed and parameterised.
+# Prices are cast to float8 so rows decode to plain floats, not Decimals.
+INSERT_PRODUCT_SQL = """
+    INSERT INTO products (name, description, price, stock)
+    VALUES ($1, $2, $3, $4)
+    RETURNING id, name, description, price::float8 AS price, stock
+"""
+
+INSERT_PRODUCTS_BULK_SQL = """
+    INSERT INTO products (name, description, price, stock)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::numeric[], $4::int[])
+    RETURNING id, name, description, price::float8 AS price, stock
+"""
+
+LIST_PRODUCTS_SQL = """
+    SELECT id, name, description, price::float8 AS price, stock
+    FROM products
+    WHERE id > $1
+    ORDER BY id
+    LIMIT $2
+"""
+
+GET_PRODUCT_SQL = """
+    SELECT id, name, description, price::float8 AS price, stock
+    FROM products
+    WHERE id = $1
+"""
+
+UPDATE_PRODUCT_SQL = """
+    UPDATE products
+    SET name = $1, description = $2, price = $3, stock = $4
+    WHERE id = $5
+    RETURNING id, name, description, price::float8 AS price, stock
+"""
+
+DELETE_PRODUCT_SQL = "DELETE FROM products WHERE id = $1 RETURNING id"
+
 # Initialize database
-def init_db():
+async def init_db():
     """Create tables if they don't exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            description TEXT,
-            price DECIMAL(10, 2) NOT NULL,
-            stock INTEGER NOT NULL
-        )
-    """)
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    async with db_conn() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                description TEXT,
+                price DECIMAL(10, 2) NOT NULL,
+                stock INTEGER NOT NULL
+            )
+        """)
 
 # Endpoints
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup"""
-    init_db()
+    """Open the connection pool and initialize database on startup"""
+    app.state.db_pool = await asyncpg.create_pool(
+        min_size=5,
+        max_size=20,
+        max_queries=10000,
+        max_inactive_connection_lifetime=600.0,
+        # Keep prepared statements for the life of the connection
+        statement_cache_size=100,
+        max_cached_statement_lifetime=0,
+        **DB_SETTINGS
+    )
+    await init_db()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled PostgreSQL and Redis connections on shutdown"""
+    pool = getattr(app.state, "db_pool", None)
+    if pool is not None:
+        await pool.close()
+        app.state.db_pool = None
+    await REDIS.connection_pool.disconnect()
 
 @app.get("/")
-def root():
+async def root():
     """Health check endpoint"""
     return {"message": "E-commerce API is running!"}
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """Check if services are healthy"""
+    async def check_postgres():
+        async with db_conn() as conn:
+            await conn.execute("SELECT 1")
+    
     try:
-        # Check PostgreSQL
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
-        conn.close()
-        
-        # Check Redis
-        r = get_redis_connection()
-        r.ping()
+        # Check PostgreSQL and Redis at the same time
+        await asyncio.gather(check_postgres(), REDIS.ping())
         
         return {
             "status": "healthy",
@@ -101,153 +281,183 @@ def health_check():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
-@app.post("/products", response_model=ProductResponse)
-def create_product(product: Product):
+@app.post("/products", response_model=None, responses=PRODUCT_RESPONSES)
+async def create_product(product: Product):
     """Create a new product"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        """
-        INSERT INTO products (name, description, price, stock)
-        VALUES (%s, %s, %s, %s)
-        RETURNING id, name, description, price, stock
-        """,
-        (product.name, product.description, product.price, product.stock)
-    )
-    
-    new_product = cursor.fetchone()
-    conn.commit()
+    async with db_conn() as conn:
+        new_product = await conn.fetchrow(
+            INSERT_PRODUCT_SQL,
+            product.name, product.description, product.price, product.stock
+        )
     
     # Invalidate cache
-    r = get_redis_connection()
-    r.delete("products:all")
-    
-    cursor.close()
-    conn.close()
+    await bump_products_rev()
     
-    return dict(new_product)
+    return ORJSONResponse(content=dict(new_product))
 
-@app.get("/products", response_model=List[ProductResponse])
-def list_products(use_cache: bool = True):
-    """List all products (with Redis caching)"""
-    r = get_redis_connection()
-    
-    # Try to get from cache
-    if use_cache:
-        cached = r.get("products:all")
-        if cached:
-            return json.loads(cached)
-    
-    # Get from database
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@app.post("/products/bulk", response_model=None, responses=PRODUCT_LIST_RESPONSES)
+async def create_products_bulk(products: List[Product]):
+    """Create many products with one INSERT per batch"""
+    if len(products) > MAX_BULK_PRODUCTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BULK_PRODUCTS} products per bulk request"
+        )
     
-    cursor.execute("SELECT * FROM products ORDER BY id")
-    products = cursor.fetchall()
+    created = []
+    async with db_conn() as conn:
+        async with conn.transaction():
+            for start in range(0, len(products), BULK_INSERT_BATCH_SIZE):
+                batch = products[start:start + BULK_INSERT_BATCH_SIZE]
+                rows = await conn.fetch(
+                    INSERT_PRODUCTS_BULK_SQL,
+                    [p.name for p in batch],
+                    [p.description for p in batch],
+                    [p.price for p in batch],
+                    [p.stock for p in batch]
+                )
+                created.extend(dict(row) for row in rows)
     
-    cursor.close()
-    conn.close()
+    # Invalidate cache
+    if created:
+        await bump_products_rev()
     
-    # Cache the result (expire in 5 minutes)
-    products_list = [dict(p) for p in products]
-    r.setex("products:all", 300, json.dumps(products_list))
+    return ORJSONResponse(content=created)
+
+@app.get("/products", response_model=None, responses=PRODUCT_PAGE_RESPONSES)
+async def list_products(
+    use_cache: bool = True,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    if_none_match: Optional[str] = Header(None)
+):
+    """List products a page at a time (with Redis caching)
+
+    The body is a JSON array of at most ``limit`` products. Pages are keyed on
+    the last id seen (``after_id``), so each request is an index range scan on
+    the primary key however large the table gets. A full page carries an
+    X-Next-Cursor header (and a rel="next" Link); pass it back as ``after_id``
+    to get the following page. Responses carry an ETag hashed from the page
+    body; sending it back in If-None-Match gets a 304 until the page changes.
+    """
+    global last_products_rev
+    r = REDIS
+    
+    # Pages are cached per revision, so writes never have to delete them.
+    # Read the revision and the list under the last revision we saw in one
+    # round-trip; only a revision change costs a second read. Each page is a
+    # hash holding the encoded body, its ETag and the cursor for the page
+    # after it.
+    guess_key = products_list_key(last_products_rev, after_id, limit)
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.get(PRODUCTS_REV_KEY)
+        pipe.hmget(guess_key, "body", "etag", "next")
+        rev, cached = await pipe.execute()
+    last_products_rev = decode_rev(rev)
+    cache_key = products_list_key(last_products_rev, after_id, limit)
     
-    return products_list
+    # Try to get from cache
+    if use_cache and cache_key != guess_key:
+        cached = await r.hmget(cache_key, "body", "etag", "next")
+    if use_cache and cached[0] and cached[1]:
+        body, etag, next_cursor = cached[0], cached[1].decode(), cached[2].decode()
+    else:
+        # Get from database
+        async with db_conn() as conn:
+            products = await conn.fetch(LIST_PRODUCTS_SQL, after_id, limit)
+        
+        # A short page means there is nothing after it
+        products_list = [dict(p) for p in products]
+        next_cursor = products_list[-1]["id"] if len(products_list) == limit else None
+        body = orjson.dumps(products_list)
+        # The tag follows the page body, so it stays unique even if the
+        # revision counter is lost and starts over
+        etag = body_etag("page", body)
+        
+        # Cache the result (expire in 5 minutes)
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.hset(cache_key, mapping={"body": body, "etag": etag, "next": next_cursor or ""})
+            pipe.expire(cache_key, 300)
+            await pipe.execute()
+    
+    # The client already has this page
+    headers = cache_headers(etag)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    # Cached pages are stored as encoded JSON, so send them as-is
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers=page_headers(headers, next_cursor, limit)
+    )
 
-@app.get("/products/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int):
-    """Get a specific product (with caching)"""
-    r = get_redis_connection()
+@app.get("/products/{product_id}", response_model=None, responses=PRODUCT_RESPONSES)
+async def get_product(product_id: int, if_none_match: Optional[str] = Header(None)):
+    """Get a specific product (with caching and ETag revalidation)"""
+    r = REDIS
     
     # Try cache first
     cache_key = f"product:{product_id}"
-    cached = r.get(cache_key)
-    if cached:
-        return json.loads(cached)
+    body = await r.get(cache_key)
     
-    # Get from database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+    if body is None:
+        # Get from database
+        async with db_conn() as conn:
+            product = await conn.fetchrow(GET_PRODUCT_SQL, product_id)
+        
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        # Cache it
+        body = orjson.dumps(dict(product))
+        await r.setex(cache_key, 300, body)
     
-    # Cache it
-    product_dict = dict(product)
-    r.setex(cache_key, 300, json.dumps(product_dict))
+    # The tag follows the body itself, so it can never vouch for a stale copy
+    # beyond the cache entry's lifetime
+    headers = cache_headers(body_etag(f"p-{product_id}", body))
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
     
-    return product_dict
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@app.put("/products/{product_id}", response_model=ProductResponse)
-def update_product(product_id: int, product: Product):
+@app.put("/products/{product_id}", response_model=None, responses=PRODUCT_RESPONSES)
+async def update_product(product_id: int, product: Product):
     """Update a product"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        """
-        UPDATE products
-        SET name = %s, description = %s, price = %s, stock = %s
-        WHERE id = %s
-        RETURNING id, name, description, price, stock
-        """,
-        (product.name, product.description, product.price, product.stock, product_id)
-    )
-    
-    updated_product = cursor.fetchone()
-    conn.commit()
+    async with db_conn() as conn:
+        updated_product = await conn.fetchrow(
+            UPDATE_PRODUCT_SQL,
+            product.name, product.description, product.price, product.stock, product_id
+        )
     
     if not updated_product:
-        cursor.close()
-        conn.close()
         raise HTTPException(status_code=404, detail="Product not found")
     
     # Invalidate cache
-    r = get_redis_connection()
-    r.delete(f"product:{product_id}")
-    r.delete("products:all")
-    
-    cursor.close()
-    conn.close()
+    await invalidate_product_cache(product_id)
     
-    return dict(updated_product)
+    return ORJSONResponse(content=dict(updated_product))
 
 @app.delete("/products/{product_id}")
-def delete_product(product_id: int):
+async def delete_product(product_id: int):
     """Delete a product"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM products WHERE id = %s RETURNING id", (product_id,))
-    deleted = cursor.fetchone()
-    conn.commit()
-    
-    cursor.close()
-    conn.close()
+    async with db_conn() as conn:
+        deleted = await conn.fetchval(DELETE_PRODUCT_SQL, product_id)
     
-    if not deleted:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
     # Invalidate cache
-    r = get_redis_connection()
-    r.delete(f"product:{product_id}")
-    r.delete("products:all")
+    await invalidate_product_cache(product_id)
     
     return {"message": "Product deleted successfully"}
 
 @app.get("/cache/stats")
-def cache_stats():
+async def cache_stats():
     """Get cache statistics"""
-    r = get_redis_connection()
+    r = REDIS
     
-    info = r.info("stats")
+    info = await r.info("stats")
     
     return {
         "total_commands_processed": info.get("total_commands_processed", 0),
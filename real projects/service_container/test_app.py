@@ -4,38 +4,51 @@ Tests database and cache functionality with service containers
 """
 import pytest
 from fastapi.testclient import TestClient
-from app import app, init_db, get_db_connection, get_redis_connection
+import app as app_module
+from app import app, get_db_connection, get_redis_connection, products_list_key
+import redis
 import time
 
 client = TestClient(app)
 
+@pytest.fixture(scope="session")
+def db():
+    """PostgreSQL connection shared by the fixtures for the whole session"""
+    conn = get_db_connection()
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+@pytest.fixture(scope="session")
+def cache():
+    """Redis client shared by the fixtures for the whole session"""
+    r = get_redis_connection()
+    yield r
+    r.close()
+
 @pytest.fixture(scope="session", autouse=True)
-def setup_database():
+def setup_database(db):
     """Initialize database before tests"""
-    init_db()
-    yield
+    # Entering the client runs startup (pool + init_db) and keeps one event
+    # loop alive for the whole session, which the async pools are bound to
+    with client:
+        yield
     # Cleanup after all tests
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DROP TABLE IF EXISTS products")
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS products")
 
 @pytest.fixture(autouse=True)
-def cleanup_data():
+def cleanup_data(db, cache):
     """Clean up data before each test"""
     # Clear database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM products")
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db.cursor() as cursor:
+        cursor.execute("TRUNCATE products RESTART IDENTITY")
     
-    # Clear Redis cache
-    r = get_redis_connection()
-    r.flushdb()
+    # Clear the API's cache keys (product:*, products:rev, products:v*) only;
+    # UNLINK frees them in the background instead of blocking like FLUSHDB
+    keys = list(cache.scan_iter(match="product*", count=1000))
+    if keys:
+        cache.unlink(*keys)
     
     yield
 
@@ -96,6 +109,74 @@ class TestProductCRUD:
         assert data[0]["name"] == "Product 1"
         assert data[1]["name"] == "Product 2"
     
+    def test_create_products_bulk_across_batches(self, monkeypatch):
+        """Test that a bulk create larger than one batch keeps order and ids"""
+        monkeypatch.setattr(app_module, "BULK_INSERT_BATCH_SIZE", 2)
+        products = [
+            {"name": f"Batch {i}", "description": "Batched", "price": 1.0 + i, "stock": i}
+            for i in range(5)
+        ]
+        
+        response = client.post("/products/bulk", json=products)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert [p["name"] for p in data] == [f"Batch {i}" for i in range(5)]
+        ids = [p["id"] for p in data]
+        assert ids == sorted(ids) and len(set(ids)) == 5
+        
+        listed = client.get("/products").json()
+        assert [(p["id"], p["name"]) for p in listed] == [(p["id"], p["name"]) for p in data]
+    
+    def test_create_products_bulk_too_large(self, monkeypatch):
+        """Test that oversized bulk requests are rejected without inserting"""
+        monkeypatch.setattr(app_module, "MAX_BULK_PRODUCTS", 3)
+        products = [
+            {"name": f"Big {i}", "description": "Too many", "price": 1.0, "stock": i}
+            for i in range(4)
+        ]
+        
+        response = client.post("/products/bulk", json=products)
+        assert response.status_code == 413
+        assert client.get("/products").json() == []
+    
+    def test_list_products_pagination(self):
+        """Test paging through products with the keyset cursor"""
+        for i in range(3):
+            client.post("/products", json={
+                "name": f"Page {i}", "description": "Paged", "price": 1.0, "stock": i
+            })
+        
+        for _ in range(2):  # database, then cache
+            first = client.get("/products", params={"limit": 2})
+            assert [p["name"] for p in first.json()] == ["Page 0", "Page 1"]
+            next_cursor = first.headers["X-Next-Cursor"]
+            assert next_cursor == str(first.json()[-1]["id"])
+            assert 'rel="next"' in first.headers["Link"]
+        
+        second = client.get("/products", params={"limit": 2, "after_id": next_cursor})
+        assert [p["name"] for p in second.json()] == ["Page 2"]
+        assert "X-Next-Cursor" not in second.headers
+    
+    def test_create_products_bulk(self):
+        """Test creating several products in one request"""
+        products = [
+            {"name": f"Bulk {i}", "description": f"Bulk desc {i}", "price": 5.5 + i, "stock": i}
+            for i in range(3)
+        ]
+        
+        response = client.post("/products/bulk", json=products)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert [p["name"] for p in data] == ["Bulk 0", "Bulk 1", "Bulk 2"]
+        assert data[1]["price"] == 6.5
+        assert all("id" in p for p in data)
+        
+        # New products show up in the (cached) list
+        response = client.get("/products")
+        assert len(response.json()) == 3
+    
     def test_get_single_product(self):
         """Test getting a single product by ID"""
         # Create a product
@@ -250,6 +331,75 @@ class TestCaching:
         assert data["name"] == "Updated"
         assert data["price"] == 40.0
     
+    def test_list_cache_refreshed_after_writes(self, cache):
+        """Test that every write bumps the revision so a cached list is replaced"""
+        def names():
+            return [p["name"] for p in client.get("/products").json()]
+        
+        first_id = client.post("/products", json={
+            "name": "A", "description": "A", "price": 1.0, "stock": 1
+        }).json()["id"]
+        assert names() == ["A"]  # fills the cache
+        
+        rev = int(cache.get("products:rev"))
+        second_id = client.post("/products", json={
+            "name": "B", "description": "B", "price": 2.0, "stock": 2
+        }).json()["id"]
+        assert int(cache.get("products:rev")) == rev + 1
+        assert names() == ["A", "B"]
+        
+        client.put(f"/products/{first_id}", json={
+            "name": "A2", "description": "A", "price": 1.0, "stock": 1
+        })
+        assert int(cache.get("products:rev")) == rev + 2
+        assert names() == ["A2", "B"]
+        
+        client.delete(f"/products/{second_id}")
+        assert int(cache.get("products:rev")) == rev + 3
+        assert names() == ["A2"]
+    
+    def test_list_reads_new_revision_after_guess_misses(self, cache):
+        """Test that a stale guessed list key falls through to the new revision"""
+        client.post("/products", json={"name": "Old", "description": "x", "price": 1.0, "stock": 1})
+        client.get("/products")
+        assert app_module.last_products_rev == cache.get("products:rev")
+        
+        # A write moves the revision past the one this worker last saw, so the
+        # pipelined guess reads a stale key and the page must come from the
+        # new revision's key instead
+        client.post("/products", json={"name": "New", "description": "x", "price": 1.0, "stock": 1})
+        new_rev = cache.get("products:rev")
+        assert app_module.last_products_rev != new_rev
+        
+        response = client.get("/products")
+        assert [p["name"] for p in response.json()] == ["Old", "New"]
+        assert app_module.last_products_rev == new_rev
+        assert cache.exists(products_list_key(new_rev, 0, 100))
+        
+        # Served from that key on the next request
+        assert client.get("/products").json() == response.json()
+    
+    def test_cache_invalidation_without_pipeline(self, cache, monkeypatch):
+        """Test that invalidation falls back to single commands if pipelining fails"""
+        product_data = {"name": "Before", "description": "x", "price": 3.0, "stock": 1}
+        product_id = client.post("/products", json=product_data).json()["id"]
+        client.get(f"/products/{product_id}")
+        client.get("/products")
+        rev = int(cache.get("products:rev"))
+        
+        def broken_pipeline(*args, **kwargs):
+            raise redis.RedisError("pipeline unavailable")
+        
+        monkeypatch.setattr(app_module.REDIS, "pipeline", broken_pipeline)
+        response = client.put(f"/products/{product_id}", json={**product_data, "name": "After"})
+        monkeypatch.undo()
+        assert response.status_code == 200
+        
+        assert int(cache.get("products:rev")) == rev + 1
+        assert not cache.exists(f"product:{product_id}")
+        assert client.get(f"/products/{product_id}").json()["name"] == "After"
+        assert [p["name"] for p in client.get("/products").json()] == ["After"]
+    
     def test_cache_invalidation_on_delete(self):
         """Test that cache is invalidated when product is deleted"""
         # Create and cache a product
@@ -273,6 +423,51 @@ class TestCaching:
         response = client.get(f"/products/{product_id}")
         assert response.status_code == 404
     
+    def test_etag_revalidation(self):
+        """Test that unchanged responses revalidate with 304 Not Modified"""
+        product_data = {
+            "name": "Tagged",
+            "description": "ETag test",
+            "price": 12.0,
+            "stock": 4
+        }
+        
+        create_response = client.post("/products", json=product_data)
+        product_id = create_response.json()["id"]
+        
+        for url in ("/products", f"/products/{product_id}"):
+            response = client.get(url)
+            etag = response.headers["ETag"]
+            assert "must-revalidate" in response.headers["Cache-Control"]
+            
+            response = client.get(url, headers={"If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.content == b""
+        
+        # A product that doesn't exist is never "not modified"
+        response = client.get("/products/99999", headers={"If-None-Match": "*"})
+        assert response.status_code == 404
+        
+        # Any write moves the ETag on
+        client.put(f"/products/{product_id}", json={**product_data, "stock": 5})
+        response = client.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()["stock"] == 5
+    
+    def test_list_etag_survives_revision_reset(self, cache):
+        """Test that the list ETag tracks the page body, not the revision counter"""
+        client.post("/products", json={"name": "First", "description": "A", "price": 1.0, "stock": 1})
+        etag = client.get("/products").headers["ETag"]
+        
+        # Lose every cache key, as a Redis restart would; the counter restarts
+        # and the next write brings it back to the same value
+        cache.unlink(*cache.scan_iter(match="product*"))
+        client.post("/products", json={"name": "Second", "description": "B", "price": 2.0, "stock": 2})
+        
+        response = client.get("/products", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert [p["name"] for p in response.json()] == ["First", "Second"]
+    
     def test_cache_stats(self):
         """Test that cache statistics are available"""
         response = client.get("/cache/stats")